@@ -0,0 +1,20 @@
+# cython: language_level=3
+# Compiled phrase counting for large chats. Build in place with:
+#     cythonize -i _phrases.pyx
+from cpython.ref cimport PyObject
+
+cdef extern from "Python.h":
+    # Declared with a raw separator pointer so NULL can be passed to split on whitespace
+    list PyUnicode_Split(object s, PyObject *sep, Py_ssize_t maxsplit)
+
+cpdef dict count_short_phrases(list responses, int max_words=5):
+    """Count the responses that are at most max_words words long"""
+    cdef dict counter = {}
+    cdef object response
+    cdef object count
+    for response in responses:
+        if not response or len(PyUnicode_Split(response, NULL, -1)) > max_words:
+            continue
+        count = counter.get(response)
+        counter[response] = 1 if count is None else count + 1
+    return counter
@@ -1,38 +1,40 @@
-import json
+import orjson
+from tqdm import tqdm
 
-def parse_whatsapp_chat(file_path, person_of_interest):
+def parse_whatsapp_chat(file_path, person_of_interest, verbose=False):
     """
     Parse a WhatsApp chat export to extract messages from a specific person using a line-by-line approach.
     
     Args:
         file_path: Path to the WhatsApp chat export file
         person_of_interest: Name of the person whose messages we want
+        verbose: Show a progress bar while parsing
         
     Returns:
         A list of dictionaries containing the person's messages and context
     """
-    # Read the file line by line
-    with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-    
-    # Process lines
     conversations = []
     last_message = None
     last_sender = None
     
-    print(f"Total lines in file: {len(lines)}")
-    
     message_count = 0
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Try to split by the first occurrence of " - "
-        try:
-            timestamp, rest = line.split(" - ", 1)
-            # Now split by the first colon to separate sender and message
-            sender, message = rest.split(": ", 1)
+    # Stream the file line by line instead of loading it all into memory
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        # tqdm rate-limits its display updates and is a no-op wrapper when disabled
+        for line in tqdm(file, desc="Parsing chat", unit=" lines", disable=not verbose):
+            line = line.strip()
+            if not line:
+                continue
+                
+            # Split at the first " - " and then the first ": ", as in "<timestamp> - <sender>: <message>".
+            # Lines without both separators don't match our expected format, could be a continuation
+            # of a previous message
+            timestamp, sep, rest = line.partition(" - ")
+            if not sep:
+                continue
+            sender, sep, message = rest.partition(": ")
+            if not sep:
+                continue
             
             message_count += 1
             
@@ -40,10 +42,6 @@ def parse_whatsapp_chat(file_path, person_of_interest):
             if '<Media omitted>' in message:
                 continue
                 
-            # Skip system messages
-            if ": " not in rest:
-                continue
-                
             if person_of_interest in sender:
                 # If there was a previous message from someone else, create a conversation pair
                 if last_message and person_of_interest not in last_sender:
@@ -62,22 +60,15 @@ def parse_whatsapp_chat(file_path, person_of_interest):
             
             last_message = message
             last_sender = sender
-            
-            # Print some progress information
-            if message_count % 1000 == 0:
-                print(f"Processed {message_count} messages...")
-                
-        except ValueError:
-            # This line doesn't match our expected format, could be a continuation of a previous message
-            continue
     
     print(f"Successfully processed {message_count} messages")
     return conversations
 
 def save_conversations(conversations, output_file):
-    """Save parsed conversations to a JSON file"""
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(conversations, f, ensure_ascii=False, indent=2)
+    """Save parsed conversations to a JSON Lines file, one conversation pair per line"""
+    with open(output_file, 'wb') as f:
+        for conv in conversations:
+            f.write(orjson.dumps(conv, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
     
     print(f"Saved {len(conversations)} conversation pairs to {output_file}")
     if conversations:
@@ -94,10 +85,10 @@ if __name__ == "__main__":
     # Replace these with your actual values
     file_path = "D:\Projects\Customized ChatBot\WhatsApp Chat with Saman\WhatsApp Chat with Saman.txt"
     person_of_interest = "Saman"
-    output_file = "saman_conversations.json"
+    output_file = "saman_conversations.jsonl"
     
     try:
-        conversations = parse_whatsapp_chat(file_path, person_of_interest)
+        conversations = parse_whatsapp_chat(file_path, person_of_interest, verbose=True)
         save_conversations(conversations, output_file)
         
         # Print some statistics
@@ -2,12 +2,26 @@ import gradio as gr
 from context_chatbot import ImprovedMemoryChatbot
 
 # Create the chatbot instance
-chatbot = ImprovedMemoryChatbot("saman_conversations.json")
+chatbot = ImprovedMemoryChatbot("saman_conversations.jsonl")
 
-# Define the chat function for Gradio
-def respond(message, history):
-    response = chatbot.get_response(message)
-    return response
+def last_reply(history):
+    """Return the bot's most recent reply from a Gradio chat history"""
+    if not history:
+        return ""
+    last_turn = history[-1]
+    # Gradio passes either [user, bot] pairs or role/content message dicts
+    if isinstance(last_turn, dict):
+        return last_turn["content"] if last_turn.get("role") == "assistant" else ""
+    return last_turn[1] or ""
+
+# Define the chat function for Gradio, streaming the reply as it is generated
+async def respond(message, history):
+    # Each session's last reply comes from its own history, not shared bot state
+    last_message = last_reply(history)
+    response = ""
+    async for chunk in chatbot.get_response(message, last_message=last_message):
+        response += chunk
+        yield response
 
 # Create the Gradio interface
 demo = gr.ChatInterface(
@@ -20,4 +34,5 @@ demo = gr.ChatInterface(
 
 # Launch the interface
 if __name__ == "__main__":
-    demo.launch()
\ No newline at end of file
+    # Serve several users at once so Ollama can batch their generations
+    demo.queue(default_concurrency_limit=16).launch()
\ No newline at end of file
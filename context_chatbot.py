@@ -1,65 +1,126 @@
-import json
+import asyncio
+import hashlib
 import os
+import faiss
+import httpx
+import numpy as np
+import orjson
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import Chroma
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain.llms import Ollama
 import re
 import random
+import heapq
+from collections import Counter
+from operator import itemgetter
+import time
+
+try:
+    # Compiled counting loop for large chats, see _phrases.pyx
+    from _phrases import count_short_phrases
+except ImportError:
+    def count_short_phrases(responses, max_words=5):
+        """Count the responses that are at most max_words words long"""
+        return Counter(response for response in responses if response and len(response.split()) <= max_words)
+
+def read_conversations(conversation_file):
+    """Yield conversation records from a JSON Lines file, or from a JSON array for older exports"""
+    with open(conversation_file, 'rb') as f:
+        # JSON Lines files are parsed one record at a time
+        if conversation_file.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+        else:
+            yield from orjson.loads(f.read())
 
 class ImprovedMemoryChatbot:
-    def __init__(self, conversation_file, model_name="llama3:8b"):
+    def __init__(self, conversation_file, model_name="llama3:8b", use_chroma=False,
+                 cache_size=512, cache_threshold=0.92, cache_ttl=600,
+                 ollama_url="http://localhost:11434", onnx_model_dir=None):
         """
         Initialize the improved memory-based chatbot
         
         Args:
-            conversation_file: Path to the JSON file with conversation data
+            conversation_file: Path to the JSON Lines (or JSON) file with conversation data
             model_name: The Ollama model to use
+            use_chroma: Use the Chroma vector store instead of the in-memory embedding matrix
+            cache_size: Number of recent queries kept in the semantic response cache
+            cache_threshold: Cosine similarity above which a cached response is reused
+            cache_ttl: Seconds before a cached response expires
+            ollama_url: Base URL of the Ollama server
+            onnx_model_dir: Directory of an int8 ONNX export (see onnx_embeddings.py) to embed with
+                instead of the FP32 PyTorch model
         """
-        # Define the persistence directory
-        self.persist_directory = "./chroma_db"
+        self.use_chroma = use_chroma
         
-        # Initialize the embeddings
-        self.embeddings = HuggingFaceEmbeddings(model_name="paraphrase-multilingual-MiniLM-L12-v2")
+        # Define the persistence directory. Vectors from different embedding backends
+        # aren't comparable, so the ONNX backend keeps its own database.
+        self.persist_directory = "./chroma_db" if use_chroma else "./vector_db"
+        if onnx_model_dir:
+            self.persist_directory += "_onnx"
+        self.vectors_path = os.path.join(self.persist_directory, "embeddings.npy")
+        self.fingerprint_path = os.path.join(self.persist_directory, "texts.sha256")
+        self.phrases_path = os.path.join(self.persist_directory, "common_phrases.txt")
+        
+        # Initialize the embeddings (normalized so queries match the batch-encoded documents)
+        self.onnx_model_dir = onnx_model_dir
+        if onnx_model_dir:
+            from onnx_embeddings import QuantizedEmbeddings
+            self.embeddings = QuantizedEmbeddings(onnx_model_dir)
+            self.embedding_dim = self.embeddings.dimension
+        else:
+            self.embeddings = HuggingFaceEmbeddings(
+                model_name="paraphrase-multilingual-MiniLM-L12-v2",
+                encode_kwargs={"normalize_embeddings": True}
+            )
+            self.embedding_dim = self.embeddings.client.get_sentence_embedding_dimension()
         
         # Check if the database already exists
         if os.path.exists(self.persist_directory) and os.listdir(self.persist_directory):
             print(f"Loading existing vector database from {self.persist_directory}")
             # Load the existing database
-            self.vector_store = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings
-            )
+            if self.use_chroma:
+                self.vector_store = Chroma(
+                    persist_directory=self.persist_directory,
+                    embedding_function=self.embeddings
+                )
+            else:
+                # Memory-map the embedding matrix so it is paged in on demand
+                self.vectors = np.load(self.vectors_path, mmap_mode='r')
             
-            # Load conversation data for common phrases and direct matching
-            with open(conversation_file, 'r', encoding='utf-8') as f:
-                self.conversations = json.load(f)
+            # Load conversation data for direct matching
+            self.load_conversations(conversation_file)
             
-            print(f"Loaded {len(self.conversations)} conversation entries")
+            if not self.use_chroma:
+                # Rebuild the texts in the same order as the embedding rows, and make sure
+                # they are the texts the embeddings were built from
+                self.create_conversation_pairs()
+                saved_fingerprint = None
+                if os.path.exists(self.fingerprint_path):
+                    with open(self.fingerprint_path, 'r', encoding='utf-8') as f:
+                        saved_fingerprint = f.read().strip()
+                if saved_fingerprint != self.texts_fingerprint():
+                    raise ValueError(
+                        f"{conversation_file} doesn't match the conversations the database in "
+                        f"{self.persist_directory} was built from; delete the directory to rebuild it"
+                    )
             
-            # Process just enough for direct matching
-            self.contexts = [conv['context'] for conv in self.conversations if conv['response']]
-            self.responses = [conv['response'] for conv in self.conversations if conv['response']]
-            
-            # Extract common phrases 
-            self.common_phrases = self.extract_common_phrases()
-            print(f"Extracted {len(self.common_phrases.split('- '))-1} common phrases")
+            # Reuse the common phrases computed when the database was built
+            if os.path.exists(self.phrases_path):
+                with open(self.phrases_path, 'r', encoding='utf-8') as f:
+                    self.common_phrases = f.read()
+                print(f"Loaded {len(self.common_phrases.split('- '))-1} common phrases")
+            else:
+                self.common_phrases = self.extract_common_phrases()
+                print(f"Extracted {len(self.common_phrases.split('- '))-1} common phrases")
+                self.save_common_phrases()
             
         else:
             # Database doesn't exist, need to create from scratch
             print(f"Creating new vector database in {self.persist_directory}")
             
             # Load conversation data
-            with open(conversation_file, 'r', encoding='utf-8') as f:
-                self.conversations = json.load(f)
-            
-            print(f"Loaded {len(self.conversations)} conversation entries")
-            
-            # Process the conversation data for retrieval
-            self.texts = []
-            self.contexts = []
-            self.responses = []
+            self.load_conversations(conversation_file)
             
             # Extract standalone phrases that person uses frequently
             self.common_phrases = self.extract_common_phrases()
@@ -68,36 +129,233 @@ class ImprovedMemoryChatbot:
             # Create conversation pairs with context
             self.create_conversation_pairs()
             
-            # Create and persist vector store
-            self.vector_store = Chroma.from_texts(
-                texts=self.texts,
-                embedding=self.embeddings,
-                persist_directory=self.persist_directory
-            )
+            # Encode all pairs in large batches
+            vectors = self.encode_texts(self.texts)
             
-            # Save the database
-            print("Saving vector database...")
-            self.vector_store.persist()
+            if self.use_chroma:
+                # Create the vector store and add the precomputed embeddings
+                self.vector_store = Chroma(
+                    persist_directory=self.persist_directory,
+                    embedding_function=self.embeddings
+                )
+                # chromadb rejects a single add() larger than the client's max batch size
+                batch_size = min(5000, getattr(self.vector_store._client, "max_batch_size", 5000))
+                for start in range(0, len(self.texts), batch_size):
+                    end = start + batch_size
+                    self.vector_store._collection.add(
+                        embeddings=vectors[start:end].tolist(),
+                        documents=self.texts[start:end],
+                        ids=[str(i) for i in range(start, min(end, len(self.texts)))]
+                    )
+                
+                # Save the database
+                print("Saving vector database...")
+                self.vector_store.persist()
+            else:
+                # Keep the normalized embeddings as a raw float32 matrix; row i is self.texts[i]
+                self.vectors = np.ascontiguousarray(vectors, dtype='float32')
+                
+                # Save the embeddings; the texts are rebuilt from the conversation file on load
+                print("Saving vector database...")
+                os.makedirs(self.persist_directory, exist_ok=True)
+                np.save(self.vectors_path, self.vectors)
+                with open(self.fingerprint_path, 'w', encoding='utf-8') as f:
+                    f.write(self.texts_fingerprint())
+            self.save_common_phrases()
             print("Database saved successfully")
         
-        # Initialize the language model
-        self.llm = Ollama(model=model_name)
+        # Lowercase and tokenize each context once for direct matching
+        self.context_lower = [context.lower() for context in self.contexts]
+        self.context_tokens = [frozenset(context.split()) for context in self.context_lower]
+        self.context_lens = [len(context.split()) for context in self.context_lower]
+        
+        # Ollama model used for generation. A shared async client lets concurrent
+        # requests reach the server together so it can batch them; it is created
+        # on the event loop that uses it (see get_client).
+        self.model_name = model_name
+        self.ollama_url = ollama_url
+        self.client = None
+        self.client_loop = None
+        
+        # Semantic caches of recent LLM responses, one per persona name, keyed by query embedding.
+        # Entries are kept in insertion order so the oldest are always at the front.
+        self.cache_size = cache_size
+        self.cache_threshold = cache_threshold
+        self.cache_ttl = cache_ttl
+        self.caches = {}
+        
+        # Prompt text around the per-request slots, rendered once per persona name
+        self.prompt_parts = {}
+        
+    def load_conversations(self, conversation_file):
+        """Load the conversation file into parallel context and response lists in a single pass"""
+        # Keep only entries with a response; the raw records are not needed afterwards
+        contexts, responses = [], []
+        count = 0
+        for conv in read_conversations(conversation_file):
+            count += 1
+            response = conv.get('response')
+            if response:
+                contexts.append(conv.get('context', ''))
+                responses.append(response)
+        
+        print(f"Loaded {count} conversation entries")
+        self.contexts, self.responses = contexts, responses
+    
+    def extract_common_phrases(self):
+        """Extract common phrases and expressions used by the person"""
+        # Count frequency of short responses (1-5 words)
+        phrase_counts = count_short_phrases(self.responses, 5)
+        
+        # Get the top 30 phrases, keeping those that appear at least 5 times. This is
+        # Counter.most_common(30), which also works on the compiled counter's plain dict.
+        top_phrases = heapq.nlargest(30, phrase_counts.items(), key=itemgetter(1))
+        common_phrases = [(phrase, count) for phrase, count in top_phrases if count >= 5]
+        
+        # Return the top phrases as a string
+        return "\n".join([f"- \"{phrase}\" (used {count} times)" for phrase, count in common_phrases])
+    
+    def save_common_phrases(self):
+        """Persist the common phrases next to the vector database"""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with open(self.phrases_path, 'w', encoding='utf-8') as f:
+            f.write(self.common_phrases)
+    
+    def create_conversation_pairs(self):
+        """Process the conversation data to create better pairs for retrieval"""
+        self.texts = [
+            f"Context: {context}\nResponse: {response}"
+            for context, response in zip(self.contexts, self.responses)
+        ]
+        
+        print(f"Created {len(self.texts)} conversation pairs for retrieval")
+    
+    def texts_fingerprint(self):
+        """Return a hash of the conversation pairs, in order, to detect a changed conversation file"""
+        return hashlib.sha256(orjson.dumps(self.texts)).hexdigest()
+    
+    def encode_texts(self, texts, batch_size=128):
+        """Encode texts into an (n, dim) array of normalized vectors"""
+        if self.onnx_model_dir:
+            return self.embeddings.encode(texts, batch_size=batch_size)
+        
+        # Call the underlying SentenceTransformer directly to control batching
+        return self.embeddings.client.encode(
+            texts,
+            batch_size=batch_size,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+    
+    def embed_message(self, message):
+        """Encode a message as a (1, dim) float32 query vector"""
+        return np.array([self.embeddings.embed_query(message)], dtype='float32')
+    
+    def find_similar_texts(self, q_vec, k=5):
+        """Return the k stored conversation pairs most similar to the query vector"""
+        if self.use_chroma:
+            similar_docs = self.vector_store.similarity_search_by_vector(q_vec[0].tolist(), k=k)
+            return [doc.page_content for doc in similar_docs]
+        
+        # Vectors are normalized, so one matrix-vector product gives every cosine similarity
+        scores = self.vectors @ q_vec[0]
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        
+        # Select the top k in O(N), then order just those best first
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.texts[i] for i in top]
+    
+    def find_direct_matches(self, message, max_matches=8):
+        """Return up to max_matches responses, most recent first, whose context is (nearly) the same as the message"""
+        message_lower = message.lower()
+        message_words = message_lower.split()
+        message_tokens = frozenset(message_words)
+        message_len = len(message_words)
+        
+        direct_matches = []
+        # Scan newest to oldest and stop once enough candidates have been found
+        for i in range(len(self.context_lower) - 1, -1, -1):
+            context = self.context_lower[i]
+            if context and (message_lower in context or context in message_lower):
+                # Overlap of distinct words over the longer message's raw word count
+                similarity = len(message_tokens & self.context_tokens[i]) / max(message_len, self.context_lens[i])
+                if similarity > 0.5:  # If messages are quite similar
+                    direct_matches.append(self.responses[i])
+                    if len(direct_matches) >= max_matches:
+                        break
+        return direct_matches
+    
+    def get_cache(self, name):
+        """Return the semantic cache for a persona, creating it on first use"""
+        cache = self.caches.get(name)
+        if cache is None:
+            cache = {"index": faiss.IndexFlatIP(self.embedding_dim), "responses": [], "times": []}
+            self.caches[name] = cache
+        return cache
+    
+    def get_cached_response(self, q_vec, name):
+        """Return a cached response from this persona for a near-identical recent query, or None"""
+        cache = self.get_cache(name)
+        
+        # Drop expired entries, which always form a prefix of the cache
+        now = time.monotonic()
+        expired = 0
+        while expired < len(cache["times"]) and now - cache["times"][expired] > self.cache_ttl:
+            expired += 1
+        if expired:
+            cache["index"].remove_ids(np.arange(expired, dtype='int64'))
+            del cache["responses"][:expired]
+            del cache["times"][:expired]
         
-        # Define the improved prompt template
-        self.prompt = PromptTemplate(
-            input_variables=["message", "similar_messages", "common_phrases", "last_message", "name"],
-            template="""You are simulating {name}'s texting style based on WhatsApp conversations. Your goal is to respond EXACTLY as {name} would.
+        if cache["index"].ntotal == 0:
+            return None
+        
+        scores, ids = cache["index"].search(q_vec, 1)
+        if scores[0][0] >= self.cache_threshold:
+            return cache["responses"][ids[0][0]]
+        return None
+    
+    def cache_response(self, q_vec, name, response):
+        """Store a generated response in the persona's semantic cache, evicting the oldest entry if full"""
+        if not response:
+            return
+        
+        cache = self.get_cache(name)
+        if cache["index"].ntotal >= self.cache_size:
+            cache["index"].remove_ids(np.arange(1, dtype='int64'))
+            del cache["responses"][0]
+            del cache["times"][0]
+        
+        cache["index"].add(q_vec)
+        cache["responses"].append(response)
+        cache["times"].append(time.monotonic())
+    
+    def get_prompt_parts(self, name):
+        """Return the fixed prompt text between the per-request slots for a persona"""
+        parts = self.prompt_parts.get(name)
+        if parts is None:
+            parts = self.render_prompt_template(name)
+            self.prompt_parts[name] = parts
+        return parts
+    
+    def render_prompt_template(self, name):
+        """Render the prompt text that goes before, between and after the per-request values"""
+        prefix = f"""You are simulating {name}'s texting style based on WhatsApp conversations. Your goal is to respond EXACTLY as {name} would.
 
 Here are messages that {name} has sent in similar contexts:
-{similar_messages}
+"""
+        mid = f"""
 
 Here are common phrases and expressions that {name} uses:
-{common_phrases}
-
-Your last message was: {last_message}
+{self.common_phrases}
 
-Now, respond to this message as {name} would:
-"{message}"
+Your last message was: """
+        tail = f'\n\nNow, respond to this message as {name} would:\n"'
+        end = f""""
 
 Important guidelines:
 1. Use the EXACT same texting style, slang, abbreviations, and emoji usage that {name} uses
@@ -108,47 +366,51 @@ Important guidelines:
 
 Your response must feel 100% authentic to {name}'s texting style:
 """
-        )
-        
-        self.chain = LLMChain(llm=self.llm, prompt=self.prompt)
-        
-        # Create a simple conversation memory - just the last exchange
-        self.last_message = ""
-        
-    def extract_common_phrases(self):
-        """Extract common phrases and expressions used by the person"""
-        # Get all responses
-        all_responses = [conv['response'] for conv in self.conversations if conv['response']]
-        
-        # Count frequency of short responses (1-5 words)
-        phrase_counter = {}
-        for response in all_responses:
-            # If it's a short response, add to counter
-            if len(response.split()) <= 5:
-                if response in phrase_counter:
-                    phrase_counter[response] += 1
-                else:
-                    phrase_counter[response] = 1
-        
-        # Get the most common phrases (appearing at least 5 times)
-        common_phrases = [(phrase, count) for phrase, count in phrase_counter.items() if count >= 5]
-        common_phrases.sort(key=lambda x: x[1], reverse=True)
-        
-        # Return the top phrases as a string
-        return "\n".join([f"- \"{phrase}\" (used {count} times)" for phrase, count in common_phrases[:30]])
+        return prefix, mid, tail, end
     
-    def create_conversation_pairs(self):
-        """Process the conversation data to create better pairs for retrieval"""
-        for conv in self.conversations:
-            if conv['response']:
-                text = f"Context: {conv['context']}\nResponse: {conv['response']}"
-                self.texts.append(text)
-                self.contexts.append(conv['context'])
-                self.responses.append(conv['response'])
-                
-        print(f"Created {len(self.texts)} conversation pairs for retrieval")
+    def build_prompt(self, message, similar_messages, name, last_message=""):
+        """Render the generation prompt for a message"""
+        prefix, mid, tail, end = self.get_prompt_parts(name)
+        return f"{prefix}{similar_messages}{mid}{last_message}{tail}{message}{end}"
     
-    def get_response(self, message, name="Saman", num_examples=5):
+    def get_client(self):
+        """Return the async HTTP client for the running event loop, creating it if needed"""
+        # A client's connection pool is bound to the loop it was first used on
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.client_loop is not loop:
+            self.client = httpx.AsyncClient(base_url=self.ollama_url, timeout=None)
+            self.client_loop = loop
+        return self.client
+    
+    async def close(self):
+        """Close the async HTTP client"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            self.client_loop = None
+    
+    async def stream_llm(self, prompt):
+        """Stream response chunks for a prompt from the Ollama chat API"""
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True
+        }
+        async with self.get_client().stream("POST", "/api/chat", json=payload) as response:
+            if response.is_error:
+                body = (await response.aread()).decode('utf-8', 'replace')
+                raise RuntimeError(f"Ollama request failed ({response.status_code}): {body}")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = orjson.loads(line)
+                if data.get('error'):
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                yield data['message']['content']
+                if data.get('done'):
+                    break
+    
+    async def get_response(self, message, name="Saman", num_examples=5, last_message=""):
         """
         Get a response to the given message with improved context matching
         
@@ -156,59 +418,85 @@ Your response must feel 100% authentic to {name}'s texting style:
             message: The message to respond to
             name: The name of the person to emulate
             num_examples: Number of examples to use
+            last_message: The previous reply in this conversation, kept by the caller per session
             
-        Returns:
-            A response that mimics the style of the person
+        Yields:
+            Chunks of a response that mimics the style of the person
         """
-        # Find similar messages in our database with more examples
-        similar_docs = self.vector_store.similarity_search(message, k=num_examples)
-        similar_messages = "\n\n".join([doc.page_content for doc in similar_docs])
+        # Encode the message once for both the cache and the vector search.
+        # Blocking model and index work runs in worker threads so that
+        # concurrent users don't stall the event loop.
+        q_vec = await asyncio.to_thread(self.embed_message, message)
         
-        # Check if we have a direct match (exactly the same or very similar message)
-        direct_matches = []
-        for i, context in enumerate(self.contexts):
-            if context and (message.lower() in context.lower() or context.lower() in message.lower()):
-                similarity = len(set(message.lower().split()) & set(context.lower().split())) / max(len(message.split()), len(context.split()))
-                if similarity > 0.5:  # If messages are quite similar
-                    direct_matches.append(self.responses[i])
+        # Reuse the answer to a recent, semantically identical message
+        cached = self.get_cached_response(q_vec, name)
+        if cached:
+            yield cached
+            return
+        
+        # Find similar messages in our database with more examples, and check for a
+        # direct match (exactly the same or very similar message) at the same time.
+        # The matrix product releases the GIL, so it overlaps with the Python scan.
+        similar_texts, direct_matches = await asyncio.gather(
+            asyncio.to_thread(self.find_similar_texts, q_vec, num_examples),
+            asyncio.to_thread(self.find_direct_matches, message)
+        )
+        similar_messages = "\n\n".join(similar_texts)
         
         # If we have direct matches, randomly select one
         if direct_matches:
-            response = random.choice(direct_matches)
+            response = random.choice(direct_matches).strip()
+            yield response
         else:
-            # Generate a response using the LLM with our improved prompt
-            response = self.chain.run(
-                message=message,
-                similar_messages=similar_messages,
-                common_phrases=self.common_phrases,
-                last_message=self.last_message,
-                name=name
-            )
-        
-        # Update the last message
-        self.last_message = response
-        
-        return response.strip()
+            # Stream a response from the LLM with our improved prompt
+            prompt = self.build_prompt(message, similar_messages, name, last_message)
+            
+            parts = []
+            async for content in self.stream_llm(prompt):
+                if not parts:
+                    # Drop whitespace the model emits before the reply
+                    content = content.lstrip()
+                if content:
+                    parts.append(content)
+                    yield content
+            
+            response = "".join(parts).strip()
+            self.cache_response(q_vec, name, response)
         
     def chat(self, name="Saman"):
         """
         Start an interactive chat session
         """
+        asyncio.run(self.chat_loop(name))
+    
+    async def chat_loop(self, name="Saman"):
+        """Run the interactive chat session on a single event loop"""
         print(f"Starting chat with {name} (type 'exit' to end)")
         print("-" * 50)
         
-        while True:
-            user_input = input("You: ")
-            if user_input.lower() in ['exit', 'quit', 'bye']:
-                print(f"{name}: Khuda hafiz!")
-                break
-                
-            response = self.get_response(user_input, name)
-            print(f"{name}: {response}")
+        # Simple conversation memory - just the last exchange
+        last_message = ""
+        try:
+            while True:
+                user_input = await asyncio.to_thread(input, "You: ")
+                if user_input.lower() in ['exit', 'quit', 'bye']:
+                    print(f"{name}: Khuda hafiz!")
+                    break
+                    
+                print(f"{name}: ", end="", flush=True)
+                parts = []
+                async for chunk in self.get_response(user_input, name, last_message=last_message):
+                    parts.append(chunk)
+                    print(chunk, end="", flush=True)
+                print()
+                last_message = "".join(parts)
+        finally:
+            # The client belongs to this event loop, which asyncio.run closes on return
+            await self.close()
 
 if __name__ == "__main__":
     # Replace with your actual values
-    conversation_file = "saman_conversations.json"
+    conversation_file = "saman_conversations.jsonl"
     
     # Create and start the chatbot
     chatbot = ImprovedMemoryChatbot(conversation_file)
@@ -14,7 +14,7 @@ class ImprovedMemoryChatbot:
         Initialize the improved memory-based chatbot
         
         Args:
-            conversation_file: Path to the JSON file with conversation data
+            conversation_file: Path to the JSON Lines (or JSON) file with conversation data
             model_name: The Ollama model to use
         """
         # Define the persistence directory
@@ -33,8 +33,7 @@ class ImprovedMemoryChatbot:
             )
             
             # Load conversation data for common phrases and direct matching
-            with open(conversation_file, 'r', encoding='utf-8') as f:
-                self.conversations = json.load(f)
+            self.conversations = self.load_conversations(conversation_file)
             
             print(f"Loaded {len(self.conversations)} conversation entries")
             
@@ -51,8 +50,7 @@ class ImprovedMemoryChatbot:
             print(f"Creating new vector database in {self.persist_directory}")
             
             # Load conversation data
-            with open(conversation_file, 'r', encoding='utf-8') as f:
-                self.conversations = json.load(f)
+            self.conversations = self.load_conversations(conversation_file)
             
             print(f"Loaded {len(self.conversations)} conversation entries")
             
@@ -113,6 +111,13 @@ Your response must feel 100% authentic to {name}'s texting style:
         # Create a conversation memory
         self.conversation_history = []
         
+    def load_conversations(self, conversation_file):
+        """Load conversation data from a JSON Lines file, or a JSON array for older exports"""
+        with open(conversation_file, 'r', encoding='utf-8') as f:
+            if conversation_file.endswith('.jsonl'):
+                return [json.loads(line) for line in f if line.strip()]
+            return json.load(f)
+    
     def extract_common_phrases(self):
         """Extract common phrases and expressions used by the person"""
         # Get all responses
@@ -208,7 +213,7 @@ Your response must feel 100% authentic to {name}'s texting style:
 
 if __name__ == "__main__":
     # Replace with your actual values
-    conversation_file = "saman_conversations.json"
+    conversation_file = "saman_conversations.jsonl"
     
     # Create and start the chatbot
     chatbot = ImprovedMemoryChatbot(conversation_file)
@@ -0,0 +1,97 @@
+import random
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+MODEL_ID = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+QUANTIZED_FILE = "model_quantized.onnx"
+
+def export_quantized_model(save_dir="onnx_int8", model_id=MODEL_ID):
+    """
+    Export the sentence-transformer to ONNX and apply int8 dynamic quantization
+
+    Args:
+        save_dir: Directory to write the quantized model and tokenizer to
+        model_id: Hugging Face id of the model to export
+    """
+    model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+    AutoTokenizer.from_pretrained(model_id).save_pretrained(save_dir)
+    print(f"Saved quantized model to {save_dir}")
+
+class QuantizedEmbeddings(Embeddings):
+    """LangChain embeddings backed by the int8 ONNX export of the sentence-transformer"""
+
+    def __init__(self, model_dir="onnx_int8", max_length=128):
+        """
+        Load a model produced by export_quantized_model
+
+        Args:
+            model_dir: Directory containing the quantized model and tokenizer
+            max_length: Maximum number of tokens per text
+        """
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=QUANTIZED_FILE)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+        self.dimension = self.model.config.hidden_size
+
+    def encode(self, texts, batch_size=128):
+        """Encode texts into an (n, dim) array of L2-normalized float32 vectors"""
+        vectors = np.empty((len(texts), self.dimension), dtype='float32')
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            hidden = self.model(**inputs).last_hidden_state
+
+            # Mean pooling over the non-padding tokens, as sentence-transformers does
+            mask = inputs["attention_mask"][..., None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            vectors[start:start + len(pooled)] = pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+def recall_at_k(reference_docs, reference_queries, candidate_docs, candidate_queries, k=5):
+    """Fraction of the reference top-k neighbours that the candidate embeddings also retrieve"""
+    reference_top = np.argsort(-(reference_queries @ reference_docs.T), axis=1)[:, :k]
+    candidate_top = np.argsort(-(candidate_queries @ candidate_docs.T), axis=1)[:, :k]
+    hits = sum(len(set(ref) & set(cand)) for ref, cand in zip(reference_top, candidate_top))
+    return hits / reference_top.size
+
+if __name__ == "__main__":
+    from sentence_transformers import SentenceTransformer
+    from context_chatbot import read_conversations
+
+    # Replace with your actual values
+    conversation_file = "saman_conversations.jsonl"
+    save_dir = "onnx_int8"
+
+    export_quantized_model(save_dir)
+
+    # Check that the quantized model retrieves the same neighbours as the FP32 one
+    conversations = [conv for conv in read_conversations(conversation_file) if conv.get('response')]
+    texts = [f"Context: {conv['context']}\nResponse: {conv['response']}" for conv in conversations]
+    queries = [conv['context'] for conv in random.sample(conversations, min(200, len(conversations))) if conv['context']]
+
+    reference = SentenceTransformer(MODEL_ID)
+    candidate = QuantizedEmbeddings(save_dir)
+    score = recall_at_k(
+        reference.encode(texts, batch_size=128, normalize_embeddings=True),
+        reference.encode(queries, batch_size=128, normalize_embeddings=True),
+        candidate.encode(texts),
+        candidate.encode(queries)
+    )
+    print(f"recall@5 of the int8 model against FP32: {score:.3f}")